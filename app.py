@@ -1,13 +1,18 @@
 import streamlit as st
 import librosa
-import numpy as np
-import soundfile as sf
 import random
 import tempfile
 import os
 import time
+import uuid
+import threading
 
 from remix_engine import remix_song
+from mood_generator import generate_mood_music, MOODS
+from dj_mixer import mix_playlist
+from feature_index import get_feature_index, preset_features, add_presets, extract_features, match
+from render_pool import get_render_pool, RenderPoolBusy
+from render_api import serve_in_background
 
 # -----------------------------------------------------------------------------
 # PAGE CONFIGURATION
@@ -177,86 +182,121 @@ def load_custom_css():
 
 load_custom_css()
 
-# -----------------------------------------------------------------------------
-# HELPER FUNCTIONS & DEFINITIONS
-# -----------------------------------------------------------------------------
+# One id per browser session, used for render queue positions
+if "session_id" not in st.session_state:
+    st.session_state["session_id"] = uuid.uuid4().hex
 
-MOODS = {
-    "happy": {"base": 440, "bpm": 120, "icon": "😄"},
-    "sad": {"base": 220, "bpm": 60, "icon": "😢"},
-    "energetic": {"base": 660, "bpm": 140, "icon": "⚡"},
-    "calm": {"base": 330, "bpm": 70, "icon": "🧘"},
-    "romantic": {"base": 350, "bpm": 75, "icon": "💖"},
-    "dark": {"base": 180, "bpm": 65, "icon": "🦇"},
-    "lofi": {"base": 300, "bpm": 85, "icon": "☕"},
-    "epic": {"base": 500, "bpm": 110, "icon": "⚔️"},
-    "chill": {"base": 280, "bpm": 90, "icon": "🧊"},
-    "focus": {"base": 400, "bpm": 100, "icon": "🧠"},
-}
-
-def sine_wave(freq, t, amp=1.0):
-    return amp * np.sin(2 * np.pi * freq * t)
-
-def adsr_envelope(signal, sr, attack=0.1, decay=0.2, sustain=0.7, release=0.3):
-    length = len(signal)
-    env = np.zeros(length)
-    a = int(attack * sr)
-    d = int(decay * sr)
-    r = int(release * sr)
-    s = length - (a + d + r)
-    s = max(0, s) # Safety check
-    
-    # Adjust envelope parts if total length is too short
-    if a + d + r > length:
-        # Simplified fallback for very short clips
-        return signal * np.linspace(1, 0, length)
-
-    env[:a] = np.linspace(0, 1, a)
-    env[a:a+d] = np.linspace(1, sustain, d)
-    env[a+d:a+d+s] = sustain
-    env[a+d+s:] = np.linspace(sustain, 0, r)
-    return signal * env
-
-def generate_drum_beat(t, sr, bpm=120):
-    beat_interval = 60 / bpm
-    drum = np.zeros_like(t)
-    num_beats = int(t[-1] / beat_interval)
-    
-    for i in range(num_beats):
-        start = int(i * beat_interval * sr)
-        if start < len(drum):
-            # Simple kick/snare synthesis
-            end = min(start + 500, len(drum))
-            drum[start:end] += np.random.randn(end-start) * 0.5 * np.exp(-np.linspace(0, 5, end-start))
-            
-    return drum
+# Optional headless API in this process, so it shares the UI's render pool
+@st.cache_resource
+def start_render_api(port):
+    return serve_in_background(port=port)
 
-def generate_mood_music(output_file, mood="happy", duration=8, sr=22050):
-    base_freq = MOODS[mood]["base"]
-    bpm = MOODS[mood]["bpm"]
+if os.environ.get("MOODMIXLY_API_PORT"):
+    start_render_api(int(os.environ["MOODMIXLY_API_PORT"]))
 
-    t = np.linspace(0, duration, int(sr * duration))
-    
-    # Simple synthesis logic
-    melody = (
-        sine_wave(base_freq, t, 0.3) +
-        sine_wave(base_freq * 1.5, t, 0.2)
-    )
-    bass = sine_wave(base_freq / 2, t, 0.25)
-    drums = generate_drum_beat(t, sr, bpm)
-
-    music = melody + bass + drums
-    music = adsr_envelope(music, sr)
-    
-    # Normalize
-    max_val = np.max(np.abs(music))
-    if max_val > 0:
-        music = music / max_val * 0.9
+# -----------------------------------------------------------------------------
+# HELPER FUNCTIONS & DEFINITIONS
+# -----------------------------------------------------------------------------
 
-    # Stereo
-    stereo_music = np.vstack((music, music * 0.95)).T
-    sf.write(output_file, stereo_music, sr)
-    return output_file
+# Feature extraction (and seeding the mood presets) runs in the render
+# pool like any other heavy job. The page never waits on it: jobs are
+# submitted once and whatever has finished is picked up on a later rerun.
+@st.cache_resource
+def preset_seeding():
+    # The index is shared by every session, so one seeding job serves them all
+    return {"job_id": None, "failed": False, "lock": threading.Lock()}
+
+def job_state(pool, job_id):
+    try:
+        return pool.status(job_id)["state"]
+    except KeyError:
+        return "failed"  # aged out of the pool's history
+
+def mood_presets_ready(pool):
+    index = get_feature_index()
+    seeding = preset_seeding()
+    with seeding["lock"]:
+        if index.count("mood") > 0 or seeding["failed"]:
+            return True
+        if seeding["job_id"] is None:
+            try:
+                seeding["job_id"] = pool.submit(st.session_state["session_id"], preset_features,
+                                                generate_mood_music, list(MOODS.keys()))
+            except RenderPoolBusy:
+                return False  # try again on a later rerun
+        state = job_state(pool, seeding["job_id"])
+        if state in ("queued", "running"):
+            return False
+        if state == "done":
+            add_presets(index, pool.wait(seeding["job_id"]))
+        else:
+            seeding["failed"] = True  # match against tracks only
+        seeding["job_id"] = None
+        return True
+
+def start_vibe_job(uploaded):
+    # One attempt per upload: if the pool is busy, vibe matching is skipped
+    # for this file rather than re-writing and re-submitting it every rerun
+    old = st.session_state.get("vibe")
+    if old and old["path"]:
+        os.remove(old["path"])
+    vibe = {"file_id": uploaded.file_id, "job_id": None, "path": None, "matches": None}
+    st.session_state["vibe"] = vibe
+
+    suffix = os.path.splitext(uploaded.name)[1] or ".wav"
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+        tmp.write(uploaded.getvalue())
+    try:
+        vibe["job_id"] = get_render_pool().submit(st.session_state["session_id"],
+                                                  extract_features, tmp.name)
+        vibe["path"] = tmp.name
+    except RenderPoolBusy:
+        os.remove(tmp.name)
+    return vibe
+
+def vibe_pending():
+    vibe = st.session_state.get("vibe")
+    return vibe is not None and vibe["job_id"] is not None
+
+def find_similar_vibes(uploaded):
+    # Returns None until both the track's features and the mood presets are in
+    vibe = st.session_state.get("vibe")
+    if vibe is None or vibe["file_id"] != uploaded.file_id:
+        vibe = start_vibe_job(uploaded)
+    if vibe["job_id"] is not None:
+        pool = get_render_pool()
+        presets_ready = mood_presets_ready(pool)
+        state = job_state(pool, vibe["job_id"])
+        if state in ("queued", "running") or (state == "done" and not presets_ready):
+            return None
+        os.remove(vibe["path"])
+        if state == "done":
+            key, vector = pool.wait(vibe["job_id"])
+            vibe["matches"] = match(get_feature_index(), key, vector)
+        vibe["job_id"] = vibe["path"] = None
+    return vibe["matches"]
+
+@st.fragment(run_every=1.0)
+def watch_vibe_job(uploaded):
+    # Polls on its own while the controls stay usable, then reruns the
+    # page once there is something to show
+    if find_similar_vibes(uploaded) is not None or not vibe_pending():
+        st.rerun()
+    st.caption("🔎 Reading the vibe of your track...")
+
+def wait_for_render(pool, job_id):
+    queue_note = st.empty()
+    while True:
+        job = pool.status(job_id)
+        if job["state"] in ("done", "failed"):
+            break
+        if job["position"]:
+            queue_note.info(f"⏳ Waiting in render queue — position {job['position']}")
+        else:
+            queue_note.info("⚙️ Rendering on the studio farm...")
+        time.sleep(0.5)
+    queue_note.empty()
+    return pool.wait(job_id)  # re-raises any render error
 
 
 # -----------------------------------------------------------------------------
@@ -264,7 +304,7 @@ def generate_mood_music(output_file, mood="happy", duration=8, sr=22050):
 # -----------------------------------------------------------------------------
 with st.sidebar:
      theme_mode = st.selectbox("🎨 Interface Theme", ["Cyberpunk", "Minimal Dark", "Glass"])
-     quality = st.select_slider("🔊 Render Quality", options=["Low", "Medium", "High", "Ultra"])
+     quality = st.select_slider("🔊 Render Quality", options=["Low", "Medium", "High", "Ultra"], value="Ultra")
      st.markdown("---")
      st.markdown("### 🚀 About")
      st.info("MoodMixly uses advanced DSP to remix and generate audio in real-time. Built for creators.")
@@ -458,7 +498,7 @@ st.markdown('<div class="wave-container"><div class="wave-bar"></div><div class=
 # -----------------------------------------------------------------------------
 # MAIN APP TABS
 # -----------------------------------------------------------------------------
-tab_remix, tab_gen, tab_stats = st.tabs(["🎛️ Remix Studio", "✨ Mood Generator", "📊 Analytics"])
+tab_remix, tab_gen, tab_mix, tab_stats = st.tabs(["🎛️ Remix Studio", "✨ Mood Generator", "🎚️ DJ Mixer", "📊 Analytics"])
 
 # ------------------------------------
 # TAB 1: REMIX STUDIO
@@ -468,6 +508,18 @@ with tab_remix:
     uploaded_file = st.file_uploader("Drop your MP3 or WAV here", type=["mp3", "wav"])
 
     if uploaded_file:
+        vibes = find_similar_vibes(uploaded_file)
+        if vibes is None and vibe_pending():
+            watch_vibe_job(uploaded_file)
+        elif vibes and vibes["moods"]:
+            best = vibes["moods"][0]["label"]
+            similar = ", ".join(t["label"] for t in vibes["tracks"]) or "none yet"
+            st.markdown(
+                f'<div class="glass-card">🔎 <b>Closest vibe:</b> {MOODS.get(best, {}).get("icon", "🎵")} {best.title()}'
+                f'<br><span style="opacity:0.7">Similar generated tracks: {similar}</span></div>',
+                unsafe_allow_html=True
+            )
+
         st.markdown("### 🎚️ Audio Controls")
         
         # Audio Controls Layout
@@ -492,6 +544,16 @@ with tab_remix:
             echo_delay = st.slider("Delay (sec)", 0.1, 1.0, 0.25)
             echo_decay = st.slider("Decay", 0.1, 1.0, 0.6)
             st.markdown('</div>', unsafe_allow_html=True)
+
+        st.markdown('<div class="glass-card">', unsafe_allow_html=True)
+        st.markdown("**🧬 Stem Separation**")
+        use_stems = st.checkbox("Stem-aware FX (bass on drums, echo & reverb on melody)")
+        s1, s2 = st.columns(2)
+        with s1:
+            harmonic_gain = st.slider("Melody Stem Level", 0.0, 2.0, 1.0, disabled=not use_stems)
+        with s2:
+            percussive_gain = st.slider("Drum Stem Level", 0.0, 2.0, 1.0, disabled=not use_stems)
+        st.markdown('</div>', unsafe_allow_html=True)
         
         # Process Button
         if st.button("🚀 IGNITE REMIX ENGINE"):
@@ -505,11 +567,21 @@ with tab_remix:
                 with tempfile.NamedTemporaryFile(delete=False, suffix="_remix.wav") as tmp_output:
                     output_path = tmp_output.name
 
-                # Processing
-                remix_song(
-                    input_path, output_path, speed, pitch_shift, bass_gain, 
-                    reverb_strength, echo_delay, echo_decay
-                )
+                # Processing (shared render pool)
+                pool = get_render_pool()
+                try:
+                    job_id = pool.submit(
+                        st.session_state["session_id"], remix_song,
+                        input_path, output_path, speed, pitch_shift, bass_gain, 
+                        reverb_strength, echo_delay, echo_decay, quality=quality,
+                        stems=use_stems, harmonic_gain=harmonic_gain,
+                        percussive_gain=percussive_gain
+                    )
+                except RenderPoolBusy as e:
+                    st.error(f"🚦 {e}")
+                    st.stop()
+
+                wait_for_render(pool, job_id)
                 
                 time.sleep(1) # Fake processing feel needed? Maybe not, but let's just show Spinner clearly
                 
@@ -547,6 +619,21 @@ with tab_gen:
         with st.spinner("🤖 Composing original melody..."):
             file_path = "generated_music.wav"
             generate_mood_music(file_path, selected_mood, duration)
+
+            # Catalogue it so future uploads can be matched against it; the
+            # mood presets are only kicked off here, not waited for
+            pool = get_render_pool()
+            try:
+                mood_presets_ready(pool)
+                job_id = pool.submit(st.session_state["session_id"], extract_features,
+                                     os.path.abspath(file_path))
+                key, vector = wait_for_render(pool, job_id)
+                vibe_index = get_feature_index()
+                vibe_index.add(key, vector, f"{MOODS[selected_mood]['icon']} {selected_mood.title()} ({duration}s)",
+                               meta={"mood": selected_mood, "duration": duration})
+                vibe_index.save()
+            except RenderPoolBusy:
+                pass  # not catalogued this time; the track itself is fine
             time.sleep(0.5)
             
             st.balloons()
@@ -560,7 +647,55 @@ with tab_gen:
                     st.download_button("⬇ Save Track", f, file_name="mood_track.wav", mime="audio/wav")
 
 # ------------------------------------
-# TAB 3: ANALYTICS & PLANS
+# TAB 3: DJ MIXER
+# ------------------------------------
+with tab_mix:
+    st.markdown('<div class="glass-card"><h3>🎚️ Beat-Matched DJ Mix</h3><p>Line up your tracks and mood jams — tempos are matched and every transition lands on the beat.</p></div>', unsafe_allow_html=True)
+
+    mix_uploads = st.file_uploader("Add tracks to the playlist (mixed in upload order)", type=["mp3", "wav"], accept_multiple_files=True, key="mix_uploads")
+    mix_moods = st.multiselect("Append generated mood tracks", list(MOODS.keys()), format_func=lambda x: f"{MOODS[x]['icon']} {x.title()}")
+    mc1, mc2 = st.columns(2)
+    with mc1:
+        mood_track_len = st.slider("Mood track length (seconds)", 10, 120, 30)
+    with mc2:
+        crossfade_beats = st.select_slider("Crossfade length (beats)", options=[4, 8, 16, 32], value=16)
+
+    if st.button("🎧 Render DJ Mix"):
+        if len(mix_uploads or []) + len(mix_moods) < 2:
+            st.warning("Add at least two tracks to build a mix.")
+        else:
+            with st.spinner("🎛️ Beat-matching your set..."):
+                playlist = []
+                for up in mix_uploads or []:
+                    suffix = os.path.splitext(up.name)[1] or ".wav"
+                    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+                        tmp.write(up.getvalue())
+                        playlist.append(tmp.name)
+                for mood in mix_moods:
+                    with tempfile.NamedTemporaryFile(delete=False, suffix=f"_{mood}.wav") as tmp:
+                        playlist.append(generate_mood_music(tmp.name, mood, mood_track_len))
+
+                with tempfile.NamedTemporaryFile(delete=False, suffix="_mix.wav") as tmp_output:
+                    mix_path = tmp_output.name
+
+                pool = get_render_pool()
+                try:
+                    job_id = pool.submit(
+                        st.session_state["session_id"], mix_playlist,
+                        playlist, mix_path, crossfade_beats
+                    )
+                except RenderPoolBusy as e:
+                    st.error(f"🚦 {e}")
+                    st.stop()
+                wait_for_render(pool, job_id)
+
+                st.success(f"✅ {len(playlist)}-track mix ready!")
+                st.audio(mix_path, format="audio/wav")
+                with open(mix_path, "rb") as f:
+                    st.download_button("⬇️ Download DJ Mix", f, file_name="moodmixly_dj_mix.wav", mime="audio/wav")
+
+# ------------------------------------
+# TAB 4: ANALYTICS & PLANS
 # ------------------------------------
 with tab_stats:
     st.markdown("### 📈 Creator Dash")
@@ -570,6 +705,14 @@ with tab_stats:
     m2.metric("Hours Streamed", "843", "+5%")
     m3.metric("Followers", "4.2K", "+84")
     m4.metric("Avg BPM", "128", "High Energy")
+
+    st.markdown("### 🖥️ Render Farm")
+    farm = get_render_pool().stats()
+    f1, f2, f3, f4 = st.columns(4)
+    f1.metric("Queue Length", f"{farm['queued']} / {farm['max_queue']}")
+    f2.metric("Rendering", f"{farm['running']} / {farm['workers']}")
+    f3.metric("Avg Wait", f"{farm['avg_wait_sec']:.1f}s", f"p95 {farm['p95_wait_sec']:.1f}s", delta_color="off")
+    f4.metric("Rejected", farm["rejected"])
     
     st.markdown("### 💎 Go Pro")
     
@@ -0,0 +1,215 @@
+import json
+import shutil
+import tempfile
+import subprocess
+import numpy as np
+
+
+# -----------------------------
+# ffmpeg Pipe Decoder
+# -----------------------------
+# Decodes through the ffmpeg binary (see packages.txt) straight into float32
+# NumPy buffers. Seeking, resampling and channel down-mix / selection all
+# happen inside ffmpeg, so only the requested excerpt is ever decoded.
+# Falls back to librosa.load when ffmpeg isn't installed.
+
+FFMPEG = shutil.which("ffmpeg")
+FFPROBE = shutil.which("ffprobe")
+
+BYTES_PER_SAMPLE = 4  # f32le
+
+
+def ffmpeg_available():
+    return FFMPEG is not None and FFPROBE is not None
+
+
+def probe_audio(path):
+    cmd = [
+        FFPROBE, "-v", "error", "-select_streams", "a:0",
+        "-show_entries", "stream=sample_rate,channels:format=duration",
+        "-of", "json", path
+    ]
+    result = subprocess.run(cmd, capture_output=True, check=False)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe failed on {path}: {result.stderr.decode(errors='ignore').strip()}")
+
+    info = json.loads(result.stdout)
+    if not info.get("streams"):
+        raise RuntimeError(f"No audio stream in {path}")
+
+    stream = info["streams"][0]
+    return {
+        "sr": int(stream["sample_rate"]),
+        "channels": int(stream["channels"]),
+        "duration": float(info.get("format", {}).get("duration") or 0.0)
+    }
+
+
+def ffmpeg_command(path, sr=None, mono_from=None, offset=0.0, duration=None, channel=None):
+    cmd = [FFMPEG, "-nostdin", "-v", "error"]
+
+    # Input-side -ss/-t: ffmpeg seeks in the container instead of decoding
+    # and discarding everything before the offset
+    if offset:
+        cmd += ["-ss", f"{offset:.6f}"]
+    if duration is not None:
+        cmd += ["-t", f"{duration:.6f}"]
+    cmd += ["-i", path, "-map", "0:a:0"]
+
+    if channel is not None:
+        cmd += ["-af", f"pan=mono|c0=c{int(channel)}"]
+    elif mono_from is not None and mono_from > 1:
+        # Plain average of all channels, same as librosa.to_mono
+        gain = 1.0 / mono_from
+        mix = "+".join(f"{gain:.8f}*c{c}" for c in range(mono_from))
+        cmd += ["-af", f"pan=mono|c0={mix}"]
+    if sr is not None:
+        cmd += ["-ar", str(int(sr))]
+
+    cmd += ["-f", "f32le", "-acodec", "pcm_f32le", "pipe:1"]
+    return cmd
+
+
+def ffmpeg_error(path, errors):
+    # The last few lines say why it stopped; don't echo megabytes of log
+    errors.seek(0)
+    message = errors.read().decode(errors="ignore").strip()[-2000:]
+    return RuntimeError(f"ffmpeg failed on {path}: {message}")
+
+
+def read_pcm(proc, n_channels, expected_frames):
+    # readinto() writes the pipe straight into the array's memory; the
+    # buffer is sized from the probe and only grows if that was short.
+    capacity = max(int(expected_frames * 1.02) + 4096, 4096) * n_channels
+    buf = np.empty(capacity, dtype=np.float32)
+    view = memoryview(buf).cast("B")
+    filled = 0
+
+    while True:
+        if filled == len(view):
+            view.release()
+            bigger = np.empty(int(len(buf) * 1.5), dtype=np.float32)
+            bigger[:len(buf)] = buf
+            buf = bigger
+            view = memoryview(buf).cast("B")
+        n = proc.stdout.readinto(view[filled:])
+        if not n:
+            break
+        filled += n
+
+    view.release()
+    frames = filled // (BYTES_PER_SAMPLE * n_channels)
+    return buf[:frames * n_channels]
+
+
+def load_audio(path, sr=None, mono=True, offset=0.0, duration=None, channel=None):
+    # Same conventions as librosa.load: returns (y, sr) with y shaped (n,)
+    # for mono and (channels, n) otherwise. sr=None keeps the native rate;
+    # channel picks a single source channel instead of down-mixing.
+    if not ffmpeg_available():
+        return librosa_load(path, sr=sr, mono=mono, offset=offset,
+                            duration=duration, channel=channel)
+
+    info = probe_audio(path)
+    out_sr = sr or info["sr"]
+    if channel is not None:
+        if not 0 <= channel < info["channels"]:
+            raise ValueError(f"channel {channel} out of range for {info['channels']}-channel file")
+        n_channels = 1
+    else:
+        n_channels = 1 if mono else info["channels"]
+
+    span = info["duration"] - offset
+    if duration is not None:
+        span = min(span, duration)
+    expected_frames = max(0, int(span * out_sr))
+
+    cmd = ffmpeg_command(path, sr=sr, mono_from=info["channels"] if mono else None,
+                         offset=offset, duration=duration, channel=channel)
+    # stderr goes to a file, not a pipe: a corrupt file can log more than a
+    # pipe buffer of errors, and ffmpeg would block writing them while we
+    # block reading stdout
+    with tempfile.TemporaryFile() as errors:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=errors)
+        try:
+            pcm = read_pcm(proc, n_channels, expected_frames)
+        finally:
+            proc.stdout.close()
+            proc.wait()
+
+        if proc.returncode != 0:
+            raise ffmpeg_error(path, errors)
+
+    if n_channels == 1:
+        return pcm, out_sr
+    return np.ascontiguousarray(pcm.reshape(-1, n_channels).T), out_sr
+
+
+def stream_audio(path, sr=None, mono=True, offset=0.0, duration=None, block_frames=65536):
+    # Generator over fixed-size blocks, shaped like load_audio's output, at
+    # `sr` (or the native rate). Memory stays at one block regardless of
+    # the file's length. Without ffmpeg this decodes the range up front.
+    if not ffmpeg_available():
+        y, _ = librosa_load(path, sr=sr, mono=mono, offset=offset, duration=duration)
+        for start in range(0, y.shape[-1], block_frames):
+            yield y[..., start:start + block_frames]
+        return
+
+    info = probe_audio(path)
+    n_channels = 1 if mono else info["channels"]
+    cmd = ffmpeg_command(path, sr=sr, mono_from=info["channels"] if mono else None,
+                         offset=offset, duration=duration)
+    block_bytes = block_frames * n_channels * BYTES_PER_SAMPLE
+
+    # stderr to a file for the same reason as load_audio
+    with tempfile.TemporaryFile() as errors:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=errors)
+        reached_end = False
+        try:
+            while True:
+                buf = np.empty(block_frames * n_channels, dtype=np.float32)
+                view = memoryview(buf).cast("B")
+                filled = 0
+                while filled < block_bytes:
+                    n = proc.stdout.readinto(view[filled:])
+                    if not n:
+                        break
+                    filled += n
+                view.release()
+
+                frames = filled // (BYTES_PER_SAMPLE * n_channels)
+                if frames == 0:
+                    break
+                block = buf[:frames * n_channels]
+                yield block if n_channels == 1 else block.reshape(-1, n_channels).T
+                if filled < block_bytes:
+                    break
+            reached_end = True
+        finally:
+            # The consumer may stop early; don't leave ffmpeg blocked on the pipe
+            if not reached_end and proc.poll() is None:
+                proc.kill()
+            proc.stdout.close()
+            proc.wait()
+
+        # A decode that dies part-way still closes stdout cleanly; without
+        # this the caller would just see a short track
+        if reached_end and proc.returncode != 0:
+            raise ffmpeg_error(path, errors)
+
+
+def get_duration(path):
+    if ffmpeg_available():
+        return probe_audio(path)["duration"]
+    import librosa
+    return librosa.get_duration(path=path)
+
+
+def librosa_load(path, sr=None, mono=True, offset=0.0, duration=None, channel=None):
+    import librosa
+
+    y, out_sr = librosa.load(path, sr=sr, mono=mono and channel is None,
+                             offset=offset, duration=duration)
+    if channel is not None:
+        y = y[channel] if y.ndim > 1 else y
+    return y, out_sr
@@ -0,0 +1,66 @@
+import sys
+import time
+import argparse
+
+import librosa
+
+from audio_decoder import load_audio, ffmpeg_available, probe_audio
+
+
+# -----------------------------
+# Decode Benchmark
+# -----------------------------
+# Compares the ffmpeg pipe decoder with the current librosa.load path on
+# full-file and excerpt decodes. Usage:
+#   python bench_decode.py song.mp3 other.wav --repeats 3 > bench_output.txt
+
+def best_time(fn, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        y, sr = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, y, sr
+
+
+def report(label, seconds, y, sr):
+    audio_sec = y.shape[-1] / sr
+    mb = y.nbytes / 1e6
+    print(f"  {label:<28} {seconds * 1000:9.1f} ms  "
+          f"{audio_sec / seconds:8.1f}x realtime  {mb / seconds:8.1f} MB/s")
+
+
+def bench_file(path, repeats, excerpt_offset, excerpt_duration, target_sr):
+    info = probe_audio(path) if ffmpeg_available() else None
+    print(f"\n🎵 {path}" + (f"  ({info['sr']} Hz, {info['channels']} ch, {info['duration']:.1f}s)" if info else ""))
+
+    cases = [
+        ("librosa full (native sr)", lambda: librosa.load(path, sr=None)),
+        ("ffmpeg  full (native sr)", lambda: load_audio(path)),
+        (f"librosa full ({target_sr} Hz)", lambda: librosa.load(path, sr=target_sr)),
+        (f"ffmpeg  full ({target_sr} Hz)", lambda: load_audio(path, sr=target_sr)),
+        (f"librosa {excerpt_duration:g}s @ {excerpt_offset:g}s",
+         lambda: librosa.load(path, sr=None, offset=excerpt_offset, duration=excerpt_duration)),
+        (f"ffmpeg  {excerpt_duration:g}s @ {excerpt_offset:g}s",
+         lambda: load_audio(path, offset=excerpt_offset, duration=excerpt_duration))
+    ]
+
+    for label, fn in cases:
+        seconds, y, sr = best_time(fn, repeats)
+        report(label, seconds, y, sr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ffmpeg pipe decoding against librosa.load")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--offset", type=float, default=30.0)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--sr", type=int, default=22050)
+    args = parser.parse_args()
+
+    if not ffmpeg_available():
+        print("⚠️ ffmpeg/ffprobe not found on PATH: both paths will use librosa", file=sys.stderr)
+
+    for path in args.files:
+        bench_file(path, args.repeats, args.offset, args.duration, args.sr)
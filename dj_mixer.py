@@ -0,0 +1,207 @@
+import os
+import time
+import math
+import librosa
+import numpy as np
+import soundfile as sf
+
+from audio_decoder import load_audio, stream_audio, get_duration
+from track_cache import content_hash, load_cached, save_cached
+
+
+# ----------------------------
+# Mixer Settings
+# ----------------------------
+MIX_SR = 44100
+BLOCK_FRAMES = 65536
+ANALYSIS_SR = 22050
+ANALYSIS_SECONDS = 60      # tempo / beat phase from the opening minute
+DEFAULT_BPM = 120.0
+
+
+# ----------------------------
+# Tempo Analysis (cached)
+# ----------------------------
+def analyse_track(path, y=None, sr=None, key=None):
+    # Callers that already decoded the track (mono) can pass it in
+    key = key or content_hash(path)
+    cached = load_cached("tempo", key)
+    if cached is not None:
+        return cached
+
+    if y is None:
+        y, sr = load_audio(path, sr=ANALYSIS_SR, mono=True, duration=ANALYSIS_SECONDS)
+    else:
+        y = y[:int(ANALYSIS_SECONDS * sr)]
+    tempo, beats = librosa.beat.beat_track(y=y, sr=sr, units="time")
+    bpm = float(np.atleast_1d(tempo)[0])
+
+    if bpm <= 0 or len(beats) == 0:
+        # No detectable pulse (pads, ambience): treat as 120 BPM from 0s
+        bpm, first_beat = DEFAULT_BPM, 0.0
+    else:
+        first_beat = float(beats[0])
+
+    return save_cached("tempo", key, {
+        "bpm": bpm,
+        "first_beat": first_beat,
+        "duration": float(get_duration(path))
+    })
+
+
+def match_rate(out_bpm, in_bpm):
+    # Stretch ratio that brings the outgoing track onto the incoming tempo,
+    # allowing half/double-time matches so 70 vs 140 BPM isn't a 2x stretch
+    candidates = [in_bpm / out_bpm, 2 * in_bpm / out_bpm, in_bpm / (2 * out_bpm)]
+    return min(candidates, key=lambda r: abs(math.log(r)))
+
+
+# ----------------------------
+# Transition Planning
+# ----------------------------
+def plan_transitions(infos, sr, crossfade_beats):
+    # Every track after the first starts on its first beat. Every track
+    # before the last ends with a tail that starts on one of its own beats
+    # and, once stretched to the next track's tempo, spans the crossfade.
+    plan = []
+    for i, info in enumerate(infos):
+        start = int(round(info["first_beat"] * sr)) if i > 0 else 0
+        total = int(info["duration"] * sr)
+        entry = {"start": start, "end": total, "tail": 0, "fade": 0, "rate": 1.0}
+
+        if i < len(infos) - 1:
+            nxt = infos[i + 1]
+            rate = match_rate(info["bpm"], nxt["bpm"])
+            fade = int(round(crossfade_beats * 60.0 / nxt["bpm"] * sr))
+
+            # Short incoming track: the fade mustn't use up more than half of
+            # it, or its own tail reads nothing and the next transition cuts
+            incoming_room = int((nxt["duration"] - nxt["first_beat"]) * sr) // 2
+            fade = min(fade, max(incoming_room, 0))
+            tail = int(math.ceil(fade * rate))
+
+            # Short outgoing track: same limit on its side
+            room = (total - start) // 2
+            if tail > room:
+                tail = max(room, 0)
+                fade = int(tail / rate)
+
+            # Snap the tail start down onto the outgoing beat grid
+            period = 60.0 / info["bpm"] * sr
+            first = info["first_beat"] * sr
+            k = math.floor((total - tail - first) / period)
+            tail_start = int(round(first + k * period)) if k >= 0 else total - tail
+            # ...but never back into the frames the previous crossfade used
+            head = plan[-1]["fade"] if plan else 0
+            tail_start = max(tail_start, start + head)
+
+            entry.update(end=tail_start + tail, tail=tail, fade=fade, rate=rate)
+        plan.append(entry)
+    return plan
+
+
+# ----------------------------
+# Streaming Helpers
+# ----------------------------
+def as_stereo(block):
+    if block.ndim == 1:
+        return np.vstack([block, block])
+    if block.shape[0] == 1:
+        return np.vstack([block[0], block[0]])
+    return block[:2]
+
+
+class BlockReader:
+    # Pulls exact frame counts out of a block generator
+    def __init__(self, blocks):
+        self.blocks = blocks
+        self.pending = np.zeros((2, 0), dtype=np.float32)
+
+    def read(self, n):
+        parts, have = [self.pending], self.pending.shape[1]
+        while have < n:
+            block = next(self.blocks, None)
+            if block is None:
+                break
+            block = as_stereo(block)
+            parts.append(block)
+            have += block.shape[1]
+        data = np.concatenate(parts, axis=1) if len(parts) > 1 else self.pending
+        self.pending = data[:, n:]
+        return data[:, :n]
+
+    def close(self):
+        self.blocks.close()
+
+
+def crossfade(outgoing, incoming):
+    n = outgoing.shape[1]
+    if incoming.shape[1] < n:
+        incoming = np.pad(incoming, ((0, 0), (0, n - incoming.shape[1])))
+    # Equal-power curves keep loudness steady through the blend
+    t = np.linspace(0.0, 1.0, n, dtype=np.float32)
+    return outgoing * np.cos(t * np.pi / 2) + incoming * np.sin(t * np.pi / 2)
+
+
+def write_block(writer, block):
+    writer.write(np.clip(block, -1.0, 1.0).T)
+
+
+# ----------------------------
+# MAIN MIX FUNCTION
+# ----------------------------
+def mix_playlist(tracks, output_file, crossfade_beats=16, sr=MIX_SR):
+    if not tracks:
+        raise ValueError("Playlist is empty")
+
+    print("🥁 Estimating tempos...")
+    infos = [analyse_track(path) for path in tracks]
+    for path, info in zip(tracks, infos):
+        print(f"   {os.path.basename(path)}: {info['bpm']:.1f} BPM")
+    plan = plan_transitions(infos, sr, crossfade_beats)
+
+    started = time.perf_counter()
+    written = 0
+    carry = None  # outgoing tail, already stretched to the next tempo
+
+    with sf.SoundFile(output_file, "w", samplerate=sr, channels=2) as writer:
+        for i, (path, step) in enumerate(zip(tracks, plan)):
+            print(f"🎚 Mixing in {os.path.basename(path)}...")
+            reader = BlockReader(stream_audio(
+                path, sr=sr, mono=False, offset=step["start"] / sr, block_frames=BLOCK_FRAMES
+            ))
+            position = step["start"]
+
+            # Blend the previous tail with this track's opening beats
+            if carry is not None:
+                head = reader.read(carry.shape[1])
+                write_block(writer, crossfade(carry, head))
+                written += carry.shape[1]
+                position += head.shape[1]
+                carry = None
+
+            # Straight copy up to the tail (or to the end for the last track)
+            last = i == len(tracks) - 1
+            body_end = step["end"] - step["tail"]
+            while last or position < body_end:
+                n = BLOCK_FRAMES if last else min(BLOCK_FRAMES, body_end - position)
+                block = reader.read(n)
+                if block.shape[1] == 0:
+                    break
+                write_block(writer, block)
+                written += block.shape[1]
+                position += block.shape[1]
+
+            if not last and step["tail"] > 0:
+                tail = reader.read(step["tail"])
+                if tail.shape[1] > 0:
+                    tail = librosa.effects.time_stretch(tail, rate=step["rate"])
+                    carry = librosa.util.fix_length(tail, size=step["fade"], axis=-1)
+
+            reader.close()
+
+    elapsed = time.perf_counter() - started
+    mix_seconds = written / sr
+    print(f"✅ Mix complete! {mix_seconds / 60:.1f} min rendered in {elapsed:.1f}s "
+          f"({mix_seconds / max(elapsed, 1e-9):.0f}x realtime)")
+    return output_file
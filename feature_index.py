@@ -0,0 +1,234 @@
+import os
+import json
+import tempfile
+import threading
+import librosa
+import numpy as np
+
+from audio_decoder import load_audio
+from dj_mixer import analyse_track
+from track_cache import CACHE_DIR, content_hash, load_cached, save_cached
+
+
+# -----------------------------
+# Feature Settings
+# -----------------------------
+
+FEATURE_SR = 22050
+FEATURE_SECONDS = 120   # summarise the first two minutes
+N_CHROMA = 12
+N_MFCC = 13
+
+# Each group gets the same total weight in the distance, however many
+# dimensions it has, so 26 MFCC stats don't drown out tempo
+FEATURE_GROUPS = [
+    ("tempo", 1),
+    ("centroid", 2),
+    ("chroma", N_CHROMA),
+    ("mfcc", 2 * N_MFCC)
+]
+FEATURE_DIM = sum(n for _, n in FEATURE_GROUPS)
+GROUP_WEIGHTS = np.concatenate([np.full(n, 1.0 / n) for _, n in FEATURE_GROUPS]).astype(np.float32)
+
+INDEX_FILE = os.path.join(CACHE_DIR, "feature_index.npz")
+KINDS = {"mood": 0, "track": 1}
+
+
+# -----------------------------
+# Feature Extraction (cached)
+# -----------------------------
+
+def extract_features(path):
+    key = content_hash(path)
+    cached = load_cached("features", key)
+    if cached is not None:
+        return key, np.asarray(cached, dtype=np.float32)
+
+    # One decode serves both the tempo analysis and the spectral features
+    y, sr = load_audio(path, sr=FEATURE_SR, mono=True, duration=FEATURE_SECONDS)
+    bpm = analyse_track(path, y=y, sr=sr, key=key)["bpm"]
+
+    centroid = librosa.feature.spectral_centroid(y=y, sr=sr)[0] / 1000.0  # kHz
+    chroma = librosa.feature.chroma_stft(y=y, sr=sr, n_chroma=N_CHROMA)
+    mfcc = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=N_MFCC)
+
+    vector = np.concatenate([
+        [bpm],
+        [centroid.mean(), centroid.std()],
+        chroma.mean(axis=1),
+        mfcc.mean(axis=1),
+        mfcc.std(axis=1)
+    ]).astype(np.float32)
+
+    save_cached("features", key, vector.tolist())
+    return key, vector
+
+
+# -----------------------------
+# Nearest-Neighbour Index
+# -----------------------------
+# Brute-force, z-scored, group-weighted Euclidean search over one packed
+# float32 matrix. Inserts are amortised O(1) (capacity doubling) and the
+# z-score statistics are running sums, so nothing is rebuilt on insert;
+# a query over tens of thousands of rows is a couple of vectorised passes.
+
+class FeatureIndex:
+    def __init__(self, capacity=1024):
+        self._lock = threading.Lock()
+        self._vectors = np.empty((capacity, FEATURE_DIM), dtype=np.float32)
+        self._kinds = np.empty(capacity, dtype=np.uint8)
+        self._sum = np.zeros(FEATURE_DIM, dtype=np.float64)
+        self._sumsq = np.zeros(FEATURE_DIM, dtype=np.float64)
+        self.keys = []
+        self.labels = []
+        self.meta = []
+        self._rows = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def count(self, kind=None):
+        with self._lock:
+            if kind is None:
+                return len(self.keys)
+            return int(np.count_nonzero(self._kinds[:len(self.keys)] == KINDS[kind]))
+
+    def _grow(self):
+        capacity = 2 * len(self._vectors)
+        vectors = np.empty((capacity, FEATURE_DIM), dtype=np.float32)
+        vectors[:len(self.keys)] = self._vectors[:len(self.keys)]
+        kinds = np.empty(capacity, dtype=np.uint8)
+        kinds[:len(self.keys)] = self._kinds[:len(self.keys)]
+        self._vectors, self._kinds = vectors, kinds
+
+    def add(self, key, vector, label, kind="track", meta=None):
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            row = self._rows.get(key)
+            if row is None:
+                if len(self.keys) == len(self._vectors):
+                    self._grow()
+                row = len(self.keys)
+                self._rows[key] = row
+                self.keys.append(key)
+                self.labels.append(label)
+                self.meta.append(meta or {})
+            else:
+                # Re-inserting the same content replaces the old entry
+                old = self._vectors[row].astype(np.float64)
+                self._sum -= old
+                self._sumsq -= old * old
+                self.labels[row] = label
+                self.meta[row] = meta or {}
+
+            self._vectors[row] = vector
+            self._kinds[row] = KINDS[kind]
+            self._sum += vector
+            self._sumsq += vector.astype(np.float64) ** 2
+            return row
+
+    def query(self, vector, k=5, kind=None, exclude_key=None):
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            n = len(self.keys)
+            if n == 0:
+                return []
+
+            mean = self._sum / n
+            var = np.maximum(self._sumsq / n - mean * mean, 1e-6)
+            weights = (GROUP_WEIGHTS / var).astype(np.float32)
+
+            diff = self._vectors[:n] - vector
+            dist = (diff * diff) @ weights
+
+            if kind is not None:
+                dist[self._kinds[:n] != KINDS[kind]] = np.inf
+            if exclude_key is not None and exclude_key in self._rows:
+                dist[self._rows[exclude_key]] = np.inf
+
+            k = min(k, n)
+            top = np.argpartition(dist, k - 1)[:k]
+            top = top[np.argsort(dist[top])]
+            return [
+                {"key": self.keys[i], "label": self.labels[i], "distance": float(np.sqrt(dist[i])),
+                 "meta": self.meta[i]}
+                for i in top if np.isfinite(dist[i])
+            ]
+
+    # -------- persistence --------
+
+    def save(self, path=INDEX_FILE):
+        with self._lock:
+            n = len(self.keys)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".npz")
+            with os.fdopen(fd, "wb") as f:
+                np.savez(
+                    f,
+                    vectors=self._vectors[:n],
+                    kinds=self._kinds[:n],
+                    keys=np.array(self.keys),
+                    labels=np.array(self.labels),
+                    meta=np.array(json.dumps(self.meta))
+                )
+            os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=INDEX_FILE):
+        data = np.load(path, allow_pickle=False)
+        index = cls(capacity=max(1024, 2 * len(data["keys"])))
+        names = {code: name for name, code in KINDS.items()}
+        meta = json.loads(str(data["meta"]))
+        for key, vector, kind, label, info in zip(
+                data["keys"], data["vectors"], data["kinds"], data["labels"], meta):
+            index.add(str(key), vector, str(label), kind=names[int(kind)], meta=info)
+        return index
+
+
+# -----------------------------
+# Catalogue Helpers
+# -----------------------------
+# preset_features and extract_features do the heavy lifting and return
+# plain (picklable) results, so the app can run them in the render pool and
+# only touch the index from its own process.
+
+def preset_features(generate_fn, moods, duration=20):
+    # Render each preset once and summarise it
+    features = []
+    for mood in moods:
+        with tempfile.NamedTemporaryFile(delete=False, suffix=f"_{mood}.wav") as tmp:
+            path = tmp.name
+        try:
+            generate_fn(path, mood, duration)
+            features.append((mood, extract_features(path)[1]))
+        finally:
+            os.remove(path)
+    return features
+
+
+def add_presets(index, features):
+    for mood, vector in features:
+        index.add(f"mood:{mood}", vector, mood, kind="mood")
+    index.save()
+
+
+def match(index, key, vector, k=3):
+    return {
+        "moods": index.query(vector, k=1, kind="mood"),
+        "tracks": index.query(vector, k=k, kind="track", exclude_key=key)
+    }
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_feature_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            try:
+                _index = FeatureIndex.load()
+            except (OSError, ValueError, KeyError):
+                _index = FeatureIndex()
+        return _index
@@ -18,6 +18,12 @@ def adsr_envelope(signal, sr, attack=0.1, decay=0.2, sustain=0.7, release=0.3):
     d = int(decay * sr)
     r = int(release * sr)
     s = length - (a + d + r)
+    s = max(0, s) # Safety check
+
+    # Adjust envelope parts if total length is too short
+    if a + d + r > length:
+        # Simplified fallback for very short clips
+        return signal * np.linspace(1, 0, length)
 
     env[:a] = np.linspace(0, 1, a)
     env[a:a+d] = np.linspace(1, sustain, d)
@@ -30,11 +36,14 @@ def adsr_envelope(signal, sr, attack=0.1, decay=0.2, sustain=0.7, release=0.3):
 def generate_drum_beat(t, sr, bpm=120):
     beat_interval = 60 / bpm
     drum = np.zeros_like(t)
+    num_beats = int(t[-1] / beat_interval)
 
-    for i in range(int(t[-1] / beat_interval)):
+    for i in range(num_beats):
         start = int(i * beat_interval * sr)
         if start < len(drum):
-            drum[start:start+200] += np.random.randn(200) * 0.3
+            # Simple kick/snare synthesis
+            end = min(start + 500, len(drum))
+            drum[start:end] += np.random.randn(end-start) * 0.5 * np.exp(-np.linspace(0, 5, end-start))
 
     return drum
 
@@ -42,20 +51,20 @@ def generate_drum_beat(t, sr, bpm=120):
 # -----------------------------
 # Mood Settings
 # -----------------------------
+# Shared by the Streamlit UI and the HTTP API, so both offer the same moods
+# and render them the same way.
 
 MOODS = {
-    "happy": {"base": 440, "bpm": 120},
-    "sad": {"base": 220, "bpm": 60},
-    "energetic": {"base": 660, "bpm": 140},
-    "calm": {"base": 330, "bpm": 70},
-    "romantic": {"base": 350, "bpm": 75},
-    "dark": {"base": 180, "bpm": 65},
-    "lofi": {"base": 300, "bpm": 85},
-    "epic": {"base": 500, "bpm": 110},
-    "chill": {"base": 280, "bpm": 90},
-    "focus": {"base": 400, "bpm": 100},
-    "uplifting": {"base": 480, "bpm": 125},
-    "mysterious": {"base": 210, "bpm": 80}
+    "happy": {"base": 440, "bpm": 120, "icon": "😄"},
+    "sad": {"base": 220, "bpm": 60, "icon": "😢"},
+    "energetic": {"base": 660, "bpm": 140, "icon": "⚡"},
+    "calm": {"base": 330, "bpm": 70, "icon": "🧘"},
+    "romantic": {"base": 350, "bpm": 75, "icon": "💖"},
+    "dark": {"base": 180, "bpm": 65, "icon": "🦇"},
+    "lofi": {"base": 300, "bpm": 85, "icon": "☕"},
+    "epic": {"base": 500, "bpm": 110, "icon": "⚔️"},
+    "chill": {"base": 280, "bpm": 90, "icon": "🧊"},
+    "focus": {"base": 400, "bpm": 100, "icon": "🧠"},
 }
 
 
@@ -76,24 +85,20 @@ def generate_mood_music(output_file,
 
     t = np.linspace(0, duration, int(sr * duration))
 
-    # 🎵 Melody Layer (major/minor intervals)
+    # 🎵 Melody Layer
     melody = (
         sine_wave(base_freq, t, 0.3) +
-        sine_wave(base_freq * 1.25, t, 0.2) +
         sine_wave(base_freq * 1.5, t, 0.2)
     )
 
-    # 🎹 Pad Layer (soft background)
-    pad = sine_wave(base_freq / 2, t, 0.15)
-
     # 🔊 Bass Layer
-    bass = sine_wave(base_freq / 4, t, 0.25)
+    bass = sine_wave(base_freq / 2, t, 0.25)
 
     # 🥁 Drum Beat
     drums = generate_drum_beat(t, sr, bpm)
 
     # Combine all layers
-    music = melody + pad + bass + drums
+    music = melody + bass + drums
 
     # Apply envelope (smooth fade)
     music = adsr_envelope(music, sr)
@@ -1,36 +1,319 @@
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import librosa
 import soundfile as sf
 import numpy as np
-from scipy.signal import butter, lfilter
+import soxr
+from math import gcd
+from scipy.signal import butter, lfilter, lfilter_zi, resample_poly, oaconvolve
+
+from audio_decoder import load_audio
+
+
+# ----------------------------
+# Render Quality Tiers
+# ----------------------------
+# "sr" is the internal processing rate (None = keep the file's native rate),
+# "n_fft" the STFT size used by time-stretch / pitch-shift, "filter_order"
+# the Butterworth order for the bass filter and "reverb_ir" the reverb
+# impulse response length in seconds.
+QUALITY_PRESETS = {
+    "Low": {"sr": 16000, "n_fft": 1024, "filter_order": 2, "reverb_ir": 0.015},
+    "Medium": {"sr": 22050, "n_fft": 1024, "filter_order": 3, "reverb_ir": 0.02},
+    "High": {"sr": 44100, "n_fft": 2048, "filter_order": 5, "reverb_ir": 0.03},
+    "Ultra": {"sr": None, "n_fft": 4096, "filter_order": 5, "reverb_ir": 0.03}
+}
+
+
+def resample_audio(audio, orig_sr, target_sr, scratch=None):
+    if orig_sr == target_sr:
+        return audio
+    # Polyphase resampling (Kaiser-windowed FIR) along the time axis
+    g = gcd(int(orig_sr), int(target_sr))
+    up = int(target_sr) // g
+    down = int(orig_sr) // g
+    n = audio.shape[-1]
+    n_out = -(-n * up // down)
+    shape = audio.shape[:-1] + (n_out,)
+    out = scratch.empty(shape, np.float32) if scratch is not None else np.empty(shape, np.float32)
+
+    # Input blocks start on multiples of `down`, so each one lands on a
+    # whole output sample; a halo wider than resample_poly's filter
+    # (half-length 10 * max(up, down) at the upsampled rate) on both sides
+    # makes the stitched blocks match a single call
+    halo = -(-(10 * max(up, down) // up + 2) // down) * down
+    step = max(1, BLOCK_SIZE // down) * down
+    for start in range(0, n, step):
+        lo = max(start - halo, 0)
+        seg = resample_poly(audio[..., lo:start + step + halo], up, down,
+                            axis=-1, window=("kaiser", 8.0))
+        o0 = start * up // down
+        o1 = min((start + step) * up // down, n_out)
+        skip = (start - lo) * up // down
+        out[..., o0:o1] = seg[..., skip:skip + o1 - o0]
+    return out
+
+
+# ----------------------------
+# Disk-backed Scratch Buffers
+# ----------------------------
+# Intermediate stage buffers bigger than the threshold live in np.memmap
+# files instead of RAM, so long / high-rate inputs page to disk rather than
+# getting the render OOM-killed. Files are removed when the render ends.
+SCRATCH_THRESHOLD_MB = float(os.environ.get("MOODMIXLY_SCRATCH_MB", 256))
+SCRATCH_DIR = os.environ.get("MOODMIXLY_SCRATCH_DIR") or None
+
+# Stage kernels walk long buffers in blocks of this many samples
+BLOCK_SIZE = 1 << 18
+
+
+class ScratchSpace:
+    def __init__(self, threshold_mb=SCRATCH_THRESHOLD_MB, scratch_dir=SCRATCH_DIR):
+        # threshold_mb=None turns disk buffers off entirely
+        self.threshold = None if threshold_mb is None else threshold_mb * 1024 * 1024
+        self.scratch_dir = scratch_dir
+        self.path = None
+        self.count = 0
+        self.lock = threading.Lock()  # channel threads allocate concurrently
+        self.parallel = True          # cleared once a render starts spilling
+
+    def spills(self, nbytes):
+        return self.threshold is not None and nbytes >= self.threshold
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
+
+    def empty(self, shape, dtype=np.float32):
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if self.threshold is None or nbytes < self.threshold:
+            return np.empty(shape, dtype=dtype)
+
+        with self.lock:
+            if self.path is None:
+                self.path = tempfile.mkdtemp(prefix="moodmixly_scratch_", dir=self.scratch_dir)
+                print(f"💽 Large input: staging buffers on disk in {self.path}")
+            self.count += 1
+            filename = os.path.join(self.path, f"stage_{self.count}.bin")
+        return np.memmap(filename, dtype=dtype, mode="w+", shape=shape)
+
+    def hold(self, array):
+        # Park a stage result in scratch (a no-op below the threshold)
+        out = self.empty(array.shape, array.dtype)
+        if isinstance(out, np.memmap):
+            for start in range(0, array.shape[-1], BLOCK_SIZE):
+                out[..., start:start + BLOCK_SIZE] = array[..., start:start + BLOCK_SIZE]
+            return out
+        return array
+
+    def cleanup(self):
+        if self.path is not None:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.path = None
+
+
+def map_channels(fn, audio, *args, out=None, parallel=True, **kwargs):
+    # Runs a 1-D stage on every channel of a (channels, n) signal, one
+    # thread per channel. The lfilter / FFT / NumPy kernels underneath drop
+    # the GIL, so channels really do run side by side. parallel=False runs
+    # them one after another, so a render that is already spilling to disk
+    # only holds one channel's working blocks in RAM at a time.
+    def run(c):
+        if out is not None:
+            return fn(audio[c], *args, out=out[c], **kwargs)
+        return fn(audio[c], *args, **kwargs)
+
+    if audio.ndim == 1:
+        return fn(audio, *args, out=out, **kwargs) if out is not None else fn(audio, *args, **kwargs)
+
+    if parallel:
+        with ThreadPoolExecutor(max_workers=audio.shape[0]) as executor:
+            results = list(executor.map(run, range(audio.shape[0])))
+    else:
+        results = [run(c) for c in range(audio.shape[0])]
+
+    return out if out is not None else np.stack(results)
+
+
+def peak(audio):
+    return max((float(np.max(np.abs(audio[..., s:s + BLOCK_SIZE])))
+                for s in range(0, audio.shape[-1], BLOCK_SIZE)), default=0.0)
 
 
 # ----------------------------
-# Utility Filters
+# Scratch-backed Spectral Stages
 # ----------------------------
-def butter_filter(data, cutoff, sr, btype='low', order=5):
-    nyquist = 0.5 * sr
-    normal_cutoff = cutoff / nyquist
-    b, a = butter(order, normal_cutoff, btype=btype, analog=False)
-    return lfilter(b, a, data)
+# librosa's time_stretch / pitch_shift / hpss / istft build every
+# full-length spectrogram and signal in RAM. These do the same maths with
+# the STFT, the phase-vocoded STFT and the output in scratch buffers,
+# touching them a block of frames at a time.
+
+def frame_block(n_bins):
+    # STFT columns per block: about BLOCK_SIZE values
+    return max(16, BLOCK_SIZE // n_bins)
+
+
+def stft_to_scratch(y, n_fft, scratch):
+    # librosa.stft already works block by block when given out=
+    hop = n_fft // 4
+    out = scratch.empty((1 + n_fft // 2, 1 + len(y) // hop), np.complex64)
+    return librosa.stft(y, n_fft=n_fft, hop_length=hop, dtype=np.complex64, out=out)
+
+
+def phase_vocoder(D, rate, n_fft, scratch):
+    # librosa.phase_vocoder frame for frame, reading D and writing the
+    # stretched STFT one block of frames at a time
+    hop = n_fft // 4
+    n_bins, n_frames = D.shape
+    time_steps = np.arange(0, n_frames, rate, dtype=np.float64)
+    out = scratch.empty((n_bins, len(time_steps)), D.dtype)
+
+    phi_advance = hop * librosa.fft_frequencies(sr=2 * np.pi, n_fft=n_fft)
+    phase_acc = np.angle(np.asarray(D[:, 0]))
+
+    for t0 in range(0, len(time_steps), frame_block(n_bins)):
+        steps = time_steps[t0:t0 + frame_block(n_bins)]
+        lo, hi = int(steps[0]), int(steps[-1]) + 2
+        # Columns past the end stay zero, like librosa's padding
+        cols = np.zeros((n_bins, hi - lo), dtype=D.dtype)
+        avail = np.asarray(D[:, lo:min(hi, n_frames)])
+        cols[:, :avail.shape[1]] = avail
+
+        block = np.empty((n_bins, len(steps)), dtype=D.dtype)
+        for t, step in enumerate(steps):
+            columns = cols[:, int(step) - lo:int(step) - lo + 2]
+            alpha = np.mod(step, 1.0)
+            mag = (1.0 - alpha) * np.abs(columns[:, 0]) + alpha * np.abs(columns[:, 1])
+            block[:, t] = librosa.util.phasor(phase_acc, mag=mag)
+
+            dphase = np.angle(columns[:, 1]) - np.angle(columns[:, 0]) - phi_advance
+            dphase = dphase - 2.0 * np.pi * np.round(dphase / (2.0 * np.pi))
+            phase_acc += phi_advance + dphase
+        out[:, t0:t0 + len(steps)] = block
+
+    return out
+
+
+def istft(D, n_fft, out):
+    # Inverse of the centred Hann STFT above, len(out) samples long:
+    # overlap-add a block of frames at a time into out, then divide each
+    # block by the window's squared sum over it
+    hop = n_fft // 4
+    pad = n_fft // 2
+    length = len(out)
+    window = librosa.filters.get_window("hann", n_fft, fftbins=True)
+    win_sq = window ** 2
+    n_frames = min(D.shape[-1], int(np.ceil((length + 2 * pad) / hop)))
+
+    for start in range(0, length, BLOCK_SIZE):
+        out[start:start + BLOCK_SIZE] = 0.0
+
+    step = frame_block(D.shape[0])
+    for k0 in range(0, n_frames, step):
+        k1 = min(k0 + step, n_frames)
+        frames = np.fft.irfft(np.asarray(D[:, k0:k1]), n=n_fft, axis=0) * window[:, None]
+        seg = np.zeros((k1 - k0 - 1) * hop + n_fft)
+        for j in range(k1 - k0):
+            seg[j * hop:j * hop + n_fft] += frames[:, j]
+
+        a = k0 * hop - pad
+        lo, hi = max(a, 0), min(a + len(seg), length)
+        if lo < hi:
+            out[lo:hi] += seg[lo - a:hi - a]
+
+    tiny = np.finfo(np.float32).tiny
+    for start in range(0, length, BLOCK_SIZE):
+        end = min(start + BLOCK_SIZE, length)
+        p0, p1 = start + pad, end + pad   # same span before trimming the padding
+        wsum = np.zeros(p1 - p0)
+        for k in range(max(0, (p0 - n_fft) // hop), min(n_frames, (p1 - 1) // hop + 1)):
+            lo, hi = max(k * hop, p0), min(k * hop + n_fft, p1)
+            if lo < hi:
+                wsum[lo - p0:hi - p0] += win_sq[lo - k * hop:hi - k * hop]
+        block = np.asarray(out[start:end])
+        nonzero = wsum > tiny
+        block[nonzero] /= wsum[nonzero]
+        out[start:end] = block
+
+    return out
+
+
+def resample_stream(y, orig_sr, target_sr, out):
+    # soxr's HQ resampler (what librosa.resample uses) streamed block by
+    # block into out, cropped / zero-padded to len(out) like fix_length
+    stream = soxr.ResampleStream(orig_sr, target_sr, 1, dtype="float32", quality="HQ")
+    pos = 0
+    for start in range(0, len(y), BLOCK_SIZE):
+        last = start + BLOCK_SIZE >= len(y)
+        chunk = stream.resample_chunk(np.asarray(y[start:start + BLOCK_SIZE], dtype=np.float32), last=last)
+        take = min(len(chunk), len(out) - pos)
+        out[pos:pos + take] = chunk[:take]
+        pos += take
+    out[pos:] = 0.0
+    return out
+
+
+def stretch_time(y, rate, n_fft, scratch, out):
+    # librosa.effects.time_stretch; out is round(len(y) / rate) long
+    spec = stft_to_scratch(y, n_fft, scratch)
+    spec = phase_vocoder(spec, rate, n_fft, scratch)
+    return istft(spec, n_fft, out)
+
+
+def shift_pitch(y, sr, n_steps, n_fft, scratch, out):
+    # librosa.effects.pitch_shift: stretch, then resample back to len(y).
+    # y is fully analysed before out is written, so out may alias y.
+    rate = 2.0 ** (-float(n_steps) / 12)
+    stretched = scratch.empty((int(round(len(y) / rate)),), np.float32)
+    stretch_time(y, rate, n_fft, scratch, stretched)
+    return resample_stream(stretched, float(sr) / rate, sr, out)
 
 
 # ----------------------------
 # Bass Boost
 # ----------------------------
-def bass_boost(audio, sr, gain=1.5, cutoff=150):
-    low_freq = butter_filter(audio, cutoff, sr, btype='low')
-    return audio + gain * low_freq
+def bass_boost(audio, sr, gain=1.5, cutoff=150, order=5, out=None):
+    b, a = butter(order, cutoff / (0.5 * sr), btype='low', analog=False)
+    if out is None:
+        out = np.empty_like(audio)
+
+    # Blockwise with carried filter state: same result as one lfilter call,
+    # but never more than a block of temporaries (out may alias audio)
+    zi = np.zeros(len(lfilter_zi(b, a)))
+    for start in range(0, len(audio), BLOCK_SIZE):
+        block = np.asarray(audio[start:start + BLOCK_SIZE])
+        low_freq, zi = lfilter(b, a, block, zi=zi)
+        out[start:start + BLOCK_SIZE] = block + gain * low_freq
+    return out
 
 
 # ----------------------------
 # Echo with Feedback
 # ----------------------------
-def add_echo(audio, sr, delay_sec=0.3, decay=0.5, feedback=0.4):
+def add_echo(audio, sr, delay_sec=0.3, decay=0.5, feedback=0.4, out=None):
     delay_samples = int(delay_sec * sr)
-    echo_audio = np.copy(audio)
-
-    for i in range(delay_samples, len(audio)):
-        echo_audio[i] += decay * echo_audio[i - delay_samples] * feedback
+    if out is None:
+        echo_audio = np.copy(audio)
+    else:
+        echo_audio = out
+        if not np.may_share_memory(out, audio):
+            echo_audio[:] = audio
+
+    g = decay * feedback
+    if delay_samples <= 0:
+        echo_audio *= 1 + g
+        return echo_audio
+
+    # y[i] += g * y[i - d] only looks back a full delay, so each delay-long
+    # block can be updated at once from the finished block before it
+    for start in range(delay_samples, len(echo_audio), delay_samples):
+        end = min(start + delay_samples, len(echo_audio))
+        echo_audio[start:end] += g * echo_audio[start - delay_samples:end - delay_samples]
 
     return echo_audio
 
@@ -38,25 +321,43 @@ def add_echo(audio, sr, delay_sec=0.3, decay=0.5, feedback=0.4):
 # ----------------------------
 # Reverb (Simple Convolution)
 # ----------------------------
-def add_reverb(audio, sr, reverb_strength=0.3):
-    kernel_size = int(0.03 * sr)
-    reverb_kernel = np.random.randn(kernel_size)
-    reverb_kernel *= reverb_strength
-    reverb_audio = np.convolve(audio, reverb_kernel, mode='same')
-    return audio + reverb_audio
+def make_reverb_kernel(sr, reverb_strength=0.3, ir_duration=0.03):
+    return np.random.randn(int(ir_duration * sr)) * reverb_strength
+
+
+def add_reverb(audio, sr, reverb_strength=0.3, ir_duration=0.03, out=None, kernel=None):
+    # Pass one kernel to every channel of a render: a fresh random IR per
+    # channel decorrelates them and collapses the stereo image
+    if kernel is None:
+        kernel = make_reverb_kernel(sr, reverb_strength, ir_duration)
+
+    if out is None:
+        out = np.empty_like(audio)
+    out[:] = audio
+
+    # Overlap-add of np.convolve(audio, kernel, mode='same'), one block at
+    # a time, so the wet signal never needs a full-length temporary
+    n = len(audio)
+    shift = (len(kernel) - 1) // 2
+    for start in range(0, n, BLOCK_SIZE):
+        wet = oaconvolve(audio[start:start + BLOCK_SIZE], kernel)
+        lo = start - shift
+        a, b = max(lo, 0), min(lo + len(wet), n)
+        out[a:b] += wet[a - lo:b - lo]
+    return out
 
 
 # ----------------------------
 # Fade In / Fade Out (Safe)
 # ----------------------------
 def add_fade(audio, sr, fade_duration=2):
-    fade_samples = min(int(fade_duration * sr), len(audio) // 2)
+    fade_samples = min(int(fade_duration * sr), audio.shape[-1] // 2)
 
     fade_in = np.linspace(0, 1, fade_samples)
     fade_out = np.linspace(1, 0, fade_samples)
 
-    audio[:fade_samples] *= fade_in
-    audio[-fade_samples:] *= fade_out
+    audio[..., :fade_samples] *= fade_in
+    audio[..., audio.shape[-1] - fade_samples:] *= fade_out
 
     return audio
 
@@ -66,22 +367,147 @@ def add_fade(audio, sr, fade_duration=2):
 # ----------------------------
 def beat_drop(audio, sr, drop_time=5, drop_duration=1):
     start = int(drop_time * sr)
-    end = min(start + int(drop_duration * sr), len(audio))
-    audio[start:end] *= 0.1
+    end = min(start + int(drop_duration * sr), audio.shape[-1])
+    audio[..., start:end] *= 0.1
     return audio
 
 
 # ----------------------------
 # Stereo Widening
 # ----------------------------
-def stereo_widen(audio):
+def stereo_widen(audio, width=1.2):
     if len(audio.shape) == 1:
         audio = np.vstack([audio, audio])
 
-    left = audio[0] * 1.1
-    right = audio[1] * 0.9
+        left = audio[0] * 1.1
+        right = audio[1] * 0.9
+
+        return np.vstack([left, right])
+
+    if audio.shape[0] != 2:
+        return audio
+
+    # Real stereo: widen with mid/side instead of faking it
+    mid = 0.5 * (audio[0] + audio[1])
+    side = 0.5 * (audio[0] - audio[1]) * width
+    return np.vstack([mid + side, mid - side])
 
-    return np.vstack([left, right])
+
+# ----------------------------
+# Stem Separation (shared STFT)
+# ----------------------------
+# Which stem each effect is applied to when stem mode is on:
+# "harmonic", "percussive" or "both".
+STEM_TARGETS = {
+    "bass": "percussive",
+    "echo": "harmonic",
+    "reverb": "harmonic"
+}
+
+
+def separate_stems(stft_matrix, scratch, kernel_size=31, margin=1.0):
+    # Median-filter HPSS works directly on the complex STFT, so the same
+    # analysis can be handed on to the phase vocoder afterwards. The time
+    # median only looks kernel_size // 2 frames either side, so blocks of
+    # frames overlapped by that much give the same result as one call.
+    harmonic = scratch.empty(stft_matrix.shape, stft_matrix.dtype)
+    percussive = scratch.empty(stft_matrix.shape, stft_matrix.dtype)
+    n_frames = stft_matrix.shape[-1]
+    halo = kernel_size // 2
+
+    for start in range(0, n_frames, frame_block(stft_matrix.shape[0])):
+        end = min(start + frame_block(stft_matrix.shape[0]), n_frames)
+        lo, hi = max(start - halo, 0), min(end + halo, n_frames)
+        h, p = librosa.decompose.hpss(np.asarray(stft_matrix[:, lo:hi]),
+                                      kernel_size=kernel_size, margin=margin)
+        harmonic[:, start:end] = h[:, start - lo:end - lo]
+        percussive[:, start:end] = p[:, start - lo:end - lo]
+
+    return harmonic, percussive
+
+
+def stretched_length(n_samples, speed):
+    return int(round(n_samples / speed))
+
+
+def stretch_stems(stems, n_samples, sr, speed, pitch_shift, n_fft, scratch, out=None):
+    ratio = 2.0 ** (pitch_shift / 12.0)
+
+    # Fold the pitch shift into the time-stretch: stretch by speed / ratio,
+    # then resample by ratio. One phase vocoder pass per stem, no re-analysis.
+    rate = speed / ratio
+    stretched_len = int(round(n_samples / rate))
+    out_len = stretched_length(n_samples, speed)
+    if out is None:
+        out = np.empty((len(stems), out_len), dtype=np.float32)
+
+    for i, stem in enumerate(stems):
+        stem = phase_vocoder(stem, rate, n_fft, scratch)
+        if pitch_shift != 0:
+            y = istft(stem, n_fft, scratch.empty((stretched_len,), np.float32))
+            resample_stream(y, float(sr) * ratio, sr, out[i])
+        else:
+            istft(stem, n_fft, out[i])
+
+    return out
+
+
+def split_and_stretch(audio, sr, speed, pitch_shift, n_fft, scratch, out=None):
+    # The whole stem stage for one channel: one STFT, HPSS on it, then one
+    # phase vocoder pass per stem. Fills (2, n): harmonic, percussive.
+    spec = stft_to_scratch(audio, n_fft, scratch)
+    harmonic, percussive = separate_stems(spec, scratch)
+    del spec
+    return stretch_stems(
+        [harmonic, percussive], audio.shape[-1], sr, speed, pitch_shift, n_fft, scratch, out=out
+    )
+
+
+def stem_compute_report(n_samples, n_fft, speed, pitch_shift, n_stems=2):
+    # Counts FFT frames (forward + inverse) for the shared-STFT stem path
+    # against separating first and then running librosa's time_stretch and
+    # pitch_shift on every stem independently.
+    hop = n_fft // 4
+    ratio = 2.0 ** (pitch_shift / 12.0)
+
+    def frames(length):
+        return 1 + int(length) // hop
+
+    f_in = frames(n_samples)
+    f_stretch = frames(n_samples / speed)
+    f_pitch = frames(n_samples / speed * ratio)
+
+    independent = f_in + n_stems * (
+        f_in +                   # istft back to a stem waveform
+        f_in + f_stretch +       # time_stretch: stft + istft
+        f_stretch + f_pitch      # pitch_shift: stft + istft
+    )
+    shared = f_in + n_stems * f_pitch   # one stft, one istft per stem
+
+    return {
+        "shared_frames": shared,
+        "independent_frames": independent,
+        "saved_frames": independent - shared,
+        "saved_pct": 100.0 * (independent - shared) / independent
+    }
+
+
+def apply_effects(audio, sr, preset, bass_gain, echo_delay, echo_decay,
+                  reverb_strength, effects=("bass", "echo", "reverb"), scratch=None,
+                  reverb_kernel=None):
+    scratch = scratch or ScratchSpace(None)
+    if "bass" in effects:
+        audio = map_channels(bass_boost, audio, sr, gain=bass_gain,
+                             order=preset["filter_order"], out=audio, parallel=scratch.parallel)
+    if "echo" in effects:
+        audio = map_channels(add_echo, audio, sr, delay_sec=echo_delay,
+                             decay=echo_decay, out=audio, parallel=scratch.parallel)
+    if "reverb" in effects:
+        if reverb_kernel is None:
+            reverb_kernel = make_reverb_kernel(sr, reverb_strength, preset["reverb_ir"])
+        audio = map_channels(add_reverb, audio, sr, kernel=reverb_kernel,
+                             out=scratch.empty(audio.shape, np.float32), parallel=scratch.parallel)
+    return audio
 
 
 # ----------------------------
@@ -95,31 +521,115 @@ def remix_song(
         bass_gain=1.4,
         reverb_strength=0.2,
         echo_delay=0.25,
-        echo_decay=0.6
+        echo_decay=0.6,
+        quality="Ultra",
+        stems=False,
+        harmonic_gain=1.0,
+        percussive_gain=1.0,
+        stem_targets=None,
+        scratch_threshold_mb=SCRATCH_THRESHOLD_MB
 ):
+    with ScratchSpace(scratch_threshold_mb) as scratch:
+        return run_remix_stages(
+            scratch, input_file, output_file, speed, pitch_shift, bass_gain,
+            reverb_strength, echo_delay, echo_decay, quality, stems,
+            harmonic_gain, percussive_gain, stem_targets
+        )
 
-    print("🎵 Loading audio...")
-    y, sr = librosa.load(input_file, sr=None)
-
-    # Speed change
-    print("⚡ Changing speed...")
-    y = librosa.effects.time_stretch(y, rate=speed)
-
-    # Pitch shift
-    print("🎼 Shifting pitch...")
-    y = librosa.effects.pitch_shift(y, sr=sr, n_steps=pitch_shift)
 
-    # Bass boost
-    print("🔊 Boosting bass...")
-    y = bass_boost(y, sr, gain=bass_gain)
+def run_remix_stages(scratch, input_file, output_file, speed, pitch_shift, bass_gain,
+                 reverb_strength, echo_delay, echo_decay, quality, stems,
+                 harmonic_gain, percussive_gain, stem_targets):
 
-    # Echo
-    print("🌊 Adding echo...")
-    y = add_echo(y, sr, delay_sec=echo_delay, decay=echo_decay)
+    if quality not in QUALITY_PRESETS:
+        quality = "Ultra"
+    preset = QUALITY_PRESETS[quality]
 
-    # Reverb
-    print("🎧 Adding reverb...")
-    y = add_reverb(y, sr, reverb_strength=reverb_strength)
+    print("🎵 Loading audio...")
+    # Keep every source channel; mono files come back 1-D
+    y, native_sr = load_audio(input_file, mono=False)
+    if scratch.spills(y.nbytes):
+        # Already past the RAM budget: stage the input and take the
+        # channels one at a time so only one set of working blocks is live
+        y = scratch.hold(y)
+        scratch.parallel = False
+        if y.ndim > 1:
+            print(f"🎧 {y.shape[0]} channels, processing one at a time...")
+    elif y.ndim > 1:
+        print(f"🎧 {y.shape[0]} channels, processing in parallel...")
+
+    # Drop to the internal processing rate (never upsample)
+    sr = native_sr
+    if preset["sr"] is not None and preset["sr"] < native_sr:
+        print(f"🎛 Resampling {native_sr} Hz → {preset['sr']} Hz ({quality} quality)...")
+        sr = preset["sr"]
+        y = resample_audio(y, native_sr, sr, scratch)
+
+    n_fft = preset["n_fft"]
+    # One impulse response for the whole render, shared by every channel
+    reverb_kernel = make_reverb_kernel(sr, reverb_strength, preset["reverb_ir"])
+
+    if stems:
+        targets = dict(STEM_TARGETS, **(stem_targets or {}))
+
+        print("🧬 Separating harmonic / percussive stems...")
+        print("⚡ Changing speed + 🎼 shifting pitch on shared STFT...")
+        n_samples = y.shape[-1]
+        # (channels, 2, n): every channel thread writes its stems in place
+        split = scratch.empty(y.shape[:-1] + (2, stretched_length(n_samples, speed)), np.float32)
+        map_channels(split_and_stretch, y, sr, speed, pitch_shift, n_fft, scratch,
+                     out=split, parallel=scratch.parallel)
+        del y
+        harmonic, percussive = split[..., 0, :], split[..., 1, :]
+
+        report = stem_compute_report(n_samples, n_fft, speed, pitch_shift)
+        print(f"🧮 Shared STFT: {report['shared_frames']} FFT frames vs "
+              f"{report['independent_frames']} independent "
+              f"({report['saved_pct']:.0f}% saved)")
+
+        print("🎛 Applying per-stem effects...")
+        stem_audio = {"harmonic": harmonic, "percussive": percussive}
+        for name in stem_audio:
+            fx = [e for e, t in targets.items() if t in (name, "both")]
+            stem_audio[name] = apply_effects(
+                stem_audio[name], sr, preset, bass_gain, echo_delay,
+                echo_decay, reverb_strength, effects=fx, scratch=scratch,
+                reverb_kernel=reverb_kernel
+            )
+
+        h, p = stem_audio["harmonic"], stem_audio["percussive"]
+        y = scratch.empty(h.shape, np.float32)
+        for start in range(0, y.shape[-1], BLOCK_SIZE):
+            part = slice(start, start + BLOCK_SIZE)
+            y[..., part] = harmonic_gain * h[..., part] + percussive_gain * p[..., part]
+
+    else:
+        # Speed change
+        print("⚡ Changing speed...")
+        stretched = scratch.empty(y.shape[:-1] + (stretched_length(y.shape[-1], speed),), np.float32)
+        y = map_channels(stretch_time, y, speed, n_fft, scratch,
+                         out=stretched, parallel=scratch.parallel)
+
+        # Pitch shift
+        print("🎼 Shifting pitch...")
+        # Same length out as in, so each channel overwrites its own row
+        y = map_channels(shift_pitch, y, sr, pitch_shift, n_fft, scratch,
+                         out=y, parallel=scratch.parallel)
+
+        # Bass boost
+        print("🔊 Boosting bass...")
+        y = map_channels(bass_boost, y, sr, gain=bass_gain, order=preset["filter_order"],
+                         out=y, parallel=scratch.parallel)
+
+        # Echo
+        print("🌊 Adding echo...")
+        y = map_channels(add_echo, y, sr, delay_sec=echo_delay, decay=echo_decay,
+                         out=y, parallel=scratch.parallel)
+
+        # Reverb
+        print("🎧 Adding reverb...")
+        y = map_channels(add_reverb, y, sr, kernel=reverb_kernel,
+                         out=scratch.empty(y.shape, np.float32), parallel=scratch.parallel)
 
     # Beat drop
     print("💥 Adding beat drop...")
@@ -129,18 +639,24 @@ def remix_song(
     print("🎚 Adding fade effects...")
     y = add_fade(y, sr)
 
+    # Back to the source rate for export
+    if sr != native_sr:
+        y = resample_audio(y, sr, native_sr, scratch)
+        sr = native_sr
+
     # Normalize safely
     print("📊 Normalizing...")
-    max_val = np.max(np.abs(y))
+    max_val = peak(y)
     if max_val > 0:
-        y = y / max_val * 0.95  # Prevent clipping
-
-    # Convert to stereo
-    y = stereo_widen(y)
+        y *= 0.95 / max_val  # Prevent clipping
 
-    # Save (transpose because soundfile expects shape (N, channels))
+    # Convert to stereo and save block by block
+    # (transpose because soundfile expects shape (N, channels))
     print("💾 Saving remixed track...")
-    sf.write(output_file, y.T, sr)
+    channels = 2 if y.ndim == 1 else max(y.shape[0], 2)
+    with sf.SoundFile(output_file, "w", samplerate=sr, channels=channels) as f:
+        for start in range(0, y.shape[-1], BLOCK_SIZE):
+            f.write(stereo_widen(y[..., start:start + BLOCK_SIZE]).T)
 
     print("✅ Remix complete!")
     return output_file
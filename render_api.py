@@ -0,0 +1,412 @@
+import os
+import json
+import time
+import struct
+import tempfile
+import argparse
+import threading
+from email.parser import BytesParser
+from email.policy import default as email_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from remix_engine import remix_song
+from mood_generator import generate_mood_music, MOODS
+from render_pool import get_render_pool, RenderPoolBusy
+
+
+# -----------------------------
+# API Settings
+# -----------------------------
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = int(os.environ.get("MOODMIXLY_API_PORT", 8765))
+MAX_UPLOAD_MB = int(os.environ.get("MOODMIXLY_MAX_UPLOAD_MB", 200))
+CHUNK_SIZE = 64 * 1024
+STREAM_POLL_SEC = 0.05
+
+
+def parse_bool(value):
+    # bool("false") is True, so only accept real JSON booleans
+    if not isinstance(value, bool):
+        raise ValueError(f"Expected true or false, got {value!r}")
+    return value
+
+
+REMIX_PARAMS = {
+    "speed": float,
+    "pitch_shift": float,
+    "bass_gain": float,
+    "reverb_strength": float,
+    "echo_delay": float,
+    "echo_decay": float,
+    "quality": str,
+    "stems": parse_bool,
+    "harmonic_gain": float,
+    "percussive_gain": float
+}
+
+MOOD_SAMPLE_RATES = (16000, 22050, 44100, 48000)
+MAX_MOOD_SECONDS = 300
+
+API_SESSION = "http-api"
+
+# job id -> rendered file, for GET /jobs/<id>/audio
+_outputs = {}
+_outputs_lock = threading.Lock()
+
+
+# -----------------------------
+# Worker-side Render Wrappers
+# -----------------------------
+# These run inside the render pool's worker processes, so they own the
+# temporary input file and remove it once the render is done.
+
+def render_remix(input_path, output_path, params):
+    try:
+        return remix_song(input_path, output_path, **params)
+    finally:
+        remove_files(input_path)
+
+
+def render_mood(output_path, mood, duration, sr):
+    return generate_mood_music(output_path, mood=mood, duration=duration, sr=sr)
+
+
+# -----------------------------
+# Request Parsing
+# -----------------------------
+
+def parse_remix_params(raw):
+    params = json.loads(raw) if raw else {}
+    if not isinstance(params, dict):
+        raise ValueError("params must be a JSON object")
+
+    unknown = set(params) - set(REMIX_PARAMS)
+    if unknown:
+        raise ValueError(f"Unknown remix params: {', '.join(sorted(unknown))}")
+
+    params = {k: REMIX_PARAMS[k](v) for k, v in params.items()}
+    if params.get("speed", 1.0) <= 0:
+        raise ValueError("speed must be greater than 0")
+    return params
+
+
+def parse_multipart(content_type, body):
+    # Let the stdlib MIME parser split the form instead of hand-rolling it
+    msg = BytesParser(policy=email_policy).parsebytes(
+        b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body
+    )
+    if not msg.is_multipart():
+        raise ValueError("Expected multipart/form-data")
+
+    fields, files = {}, {}
+    for part in msg.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        if not name:
+            continue
+        payload = part.get_payload(decode=True) or b""
+        filename = part.get_filename()
+        if filename:
+            files[name] = (filename, payload)
+        else:
+            fields[name] = payload.decode("utf-8")
+    return fields, files
+
+
+def remove_files(*paths):
+    for path in paths:
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
+def prune_outputs(pool):
+    # Drop rendered files for jobs the pool has already forgotten
+    with _outputs_lock:
+        for job_id in list(_outputs):
+            try:
+                pool.status(job_id)
+            except KeyError:
+                remove_files(_outputs.pop(job_id))
+
+
+def new_output_path(suffix):
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+        return tmp.name
+
+
+# -----------------------------
+# Live WAV Streaming
+# -----------------------------
+# soundfile writes the WAV header (with a zero data size) when the worker
+# opens the output, appends PCM as each block is encoded, and only fills in
+# the sizes on close. So the API can send an open-ended header straight
+# away and follow the file as it grows, finishing at the final data size.
+
+def wav_layout(path):
+    # (chunks between "WAVE" and "data", PCM offset, data size), or None
+    # until the header is on disk
+    try:
+        with open(path, "rb") as f:
+            head = f.read(4096)
+    except OSError:
+        return None
+    if len(head) < 12 or head[:4] != b"RIFF" or head[8:12] != b"WAVE":
+        return None
+
+    pos = 12
+    while pos + 8 <= len(head):
+        chunk_id = head[pos:pos + 4]
+        size = struct.unpack("<I", head[pos + 4:pos + 8])[0]
+        if chunk_id == b"data":
+            return head[12:pos], pos + 8, size
+        pos += 8 + size + (size & 1)
+    return None
+
+
+def open_ended_header(chunks):
+    # 0xFFFFFFFF sizes are the usual "length unknown" marker for streamed WAV
+    unknown = struct.pack("<I", 0xFFFFFFFF)
+    return b"RIFF" + unknown + b"WAVE" + chunks + b"data" + unknown
+
+
+# -----------------------------
+# HTTP Handler
+# -----------------------------
+
+class RenderAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MoodMixlyAPI/1.0"
+
+    # -------- responses --------
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, message, headers=None):
+        self.send_json(status, {"error": message}, headers)
+
+    def write_chunk(self, data):
+        self.wfile.write(b"%X\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def stream_render(self, pool, job_id, path, filename):
+        # Chunked transfer of the WAV while the worker is still encoding it;
+        # never more than one chunk in memory.
+        while True:
+            status = pool.status(job_id)
+            layout = wav_layout(path)
+            if layout or status["state"] in ("done", "failed"):
+                break
+            time.sleep(STREAM_POLL_SEC)
+
+        # Nothing sent yet, so failures can still get a proper status
+        status = pool.status(job_id)
+        if status["state"] == "failed":
+            return self.send_error_json(500, f"Render failed: {status['error']}")
+        if layout is None:
+            return self.send_error_json(500, "Render produced no audio")
+
+        chunks, offset, _ = layout
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/wav")
+        self.send_header("Content-Disposition", f'attachment; filename="{filename}"')
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self.write_chunk(open_ended_header(chunks))
+
+        with open(path, "rb") as f:
+            f.seek(offset)
+            pos = offset
+            while True:
+                # Check the state before reading so the last pass sees it all
+                state = pool.status(job_id)["state"]
+                end = os.path.getsize(path)
+                if state == "done":
+                    final = wav_layout(path)
+                    if final:
+                        end = min(end, final[1] + final[2])
+
+                while pos < end:
+                    data = f.read(min(CHUNK_SIZE, end - pos))
+                    if not data:
+                        break
+                    self.write_chunk(data)
+                    pos += len(data)
+
+                if state == "failed":
+                    # Too late for an error status: drop the connection so the
+                    # client can't mistake a partial file for a whole one
+                    self.close_connection = True
+                    return
+                if state == "done":
+                    break
+                time.sleep(STREAM_POLL_SEC)
+
+        self.wfile.write(b"0\r\n\r\n")
+
+    # -------- routing --------
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        pool = get_render_pool()
+
+        if parts == ["health"]:
+            return self.send_json(200, {"status": "ok"})
+
+        if parts == ["stats"]:
+            return self.send_json(200, pool.stats())
+
+        if parts == ["moods"]:
+            return self.send_json(200, {"moods": sorted(MOODS)})
+
+        if len(parts) in (2, 3) and parts[0] == "jobs":
+            job_id = parts[1]
+            try:
+                status = pool.status(job_id)
+            except KeyError as e:
+                return self.send_error_json(404, str(e))
+
+            if len(parts) == 2:
+                return self.send_json(200, status)
+
+            if parts[2] == "audio":
+                if status["state"] == "failed":
+                    return self.send_error_json(409, f"Job is {status['state']}")
+                with _outputs_lock:
+                    path = _outputs.get(job_id)
+                if not path or not os.path.exists(path):
+                    return self.send_error_json(410, "Rendered audio is no longer available")
+                # Queued / running jobs stream live as the worker encodes
+                return self.stream_render(pool, job_id, path, f"{job_id}.wav")
+
+        self.send_error_json(404, "Not found")
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        run_async = query.get("async", ["0"])[0].lower() in ("1", "true", "yes")
+
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_UPLOAD_MB * 1024 * 1024:
+            self.close_connection = True
+            return self.send_error_json(413, f"Upload larger than {MAX_UPLOAD_MB} MB")
+        body = self.rfile.read(length)
+
+        try:
+            if url.path == "/remix":
+                fn, args, output_path, filename = self.prepare_remix(body)
+            elif url.path == "/mood":
+                fn, args, output_path, filename = self.prepare_mood(body)
+            else:
+                return self.send_error_json(404, "Not found")
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            return self.send_error_json(400, str(e))
+
+        pool = get_render_pool()
+        try:
+            job_id = pool.submit(API_SESSION, fn, *args)
+        except RenderPoolBusy as e:
+            remove_files(output_path)
+            if fn is render_remix:
+                remove_files(args[0])
+            return self.send_error_json(503, str(e), {"Retry-After": "5"})
+
+        with _outputs_lock:
+            _outputs[job_id] = output_path
+        prune_outputs(pool)
+
+        if run_async:
+            status = pool.status(job_id)
+            status["status_url"] = f"/jobs/{job_id}"
+            status["audio_url"] = f"/jobs/{job_id}/audio"
+            return self.send_json(202, status, {"Location": status["status_url"]})
+
+        try:
+            self.stream_render(pool, job_id, output_path, filename)
+        finally:
+            # Synchronous renders are handed over exactly once
+            with _outputs_lock:
+                _outputs.pop(job_id, None)
+            remove_files(output_path)
+
+    # -------- job builders --------
+
+    def prepare_remix(self, body):
+        fields, files = parse_multipart(self.headers.get("Content-Type", ""), body)
+        if "file" not in files:
+            raise ValueError("Missing 'file' upload")
+        params = parse_remix_params(fields.get("params"))
+
+        filename, data = files["file"]
+        suffix = os.path.splitext(filename)[1].lower() or ".wav"
+        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+            tmp.write(data)
+            input_path = tmp.name
+
+        output_path = new_output_path("_remix.wav")
+        return render_remix, (input_path, output_path, params), output_path, "remixed_track.wav"
+
+    def prepare_mood(self, body):
+        params = json.loads(body or b"{}")
+        if not isinstance(params, dict):
+            raise ValueError("Body must be a JSON object")
+        mood = str(params.get("mood", "happy"))
+        if mood not in MOODS:
+            raise ValueError(f"Unknown mood '{mood}'")
+        duration = float(params.get("duration", 8))
+        if not 0 < duration <= MAX_MOOD_SECONDS:
+            raise ValueError(f"duration must be between 0 and {MAX_MOOD_SECONDS} seconds")
+        sr = params.get("sr", 22050)
+        if sr not in MOOD_SAMPLE_RATES:
+            raise ValueError(f"sr must be one of {', '.join(map(str, MOOD_SAMPLE_RATES))}")
+        sr = int(sr)
+
+        output_path = new_output_path("_mood.wav")
+        return render_mood, (output_path, mood, duration, sr), output_path, f"{mood}_track.wav"
+
+    def log_message(self, format, *args):
+        print(f"🌐 {self.address_string()} {format % args}")
+
+
+# -----------------------------
+# Server Entry Points
+# -----------------------------
+
+def create_server(host=DEFAULT_HOST, port=DEFAULT_PORT):
+    server = ThreadingHTTPServer((host, port), RenderAPIHandler)
+    server.daemon_threads = True
+    return server
+
+
+def serve_in_background(host=DEFAULT_HOST, port=DEFAULT_PORT):
+    # Used by the Streamlit app so the API shares its render pool
+    server = create_server(host, port)
+    thread = threading.Thread(target=server.serve_forever, name="render-api", daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MoodMixly headless render API")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    cli = parser.parse_args()
+
+    server = create_server(cli.host, cli.port)
+    print(f"🎧 MoodMixly render API listening on http://{cli.host}:{cli.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        get_render_pool().shutdown(wait=False)
@@ -0,0 +1,265 @@
+import os
+import math
+import time
+import uuid
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+# -----------------------------
+# Pool Settings
+# -----------------------------
+# All three can be overridden per host through environment variables.
+
+DEFAULT_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+MAX_WORKERS = int(os.environ.get("MOODMIXLY_RENDER_WORKERS", DEFAULT_WORKERS))
+MAX_QUEUE = int(os.environ.get("MOODMIXLY_RENDER_QUEUE", 16))
+CPU_BUDGET = float(os.environ.get("MOODMIXLY_CPU_BUDGET", 1.0))  # 1-min load per core
+
+FINISHED_HISTORY = 256
+WAIT_HISTORY = 500
+
+
+class RenderPoolBusy(RuntimeError):
+    pass
+
+
+class RenderJob:
+    def __init__(self, session_id, fn, args, kwargs):
+        self.id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.state = "queued"
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.executor = None
+        self.done = threading.Event()
+
+    def wait_time(self):
+        end = self.started_at or time.time()
+        return end - self.submitted_at
+
+
+def cpu_load():
+    # Normalised 1-minute load average; None where the OS doesn't expose it
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (AttributeError, OSError):
+        return None
+
+
+# -----------------------------
+# Render Pool
+# -----------------------------
+
+# Process pool shared by every session in this server. At most max_workers
+# renders run at once; further jobs wait in a FIFO queue up to max_queue deep
+# and are rejected beyond that. While host load is over cpu_budget, queued
+# jobs are deferred (unless nothing of ours is running, so it can't stall).
+class RenderPool:
+    def __init__(self, max_workers=MAX_WORKERS, max_queue=MAX_QUEUE, cpu_budget=CPU_BUDGET):
+        self.max_workers = max(1, int(max_workers))
+        self.max_queue = max(0, int(max_queue))
+        self.cpu_budget = cpu_budget
+
+        self._cond = threading.Condition()
+        self._pending = deque()
+        self._running = {}
+        self._finished = deque()
+        self._jobs = {}
+        self._waits = deque(maxlen=WAIT_HISTORY)
+        self._counts = {"completed": 0, "failed": 0, "rejected": 0}
+        self._closed = False
+
+        self._executor = self._new_executor()
+        self._dispatcher = threading.Thread(
+            target=self._dispatch_loop, name="render-pool-dispatch", daemon=True
+        )
+        self._dispatcher.start()
+
+    def _new_executor(self):
+        # spawn: forking a threaded server process is not safe
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+
+    def _replace_executor(self, broken):
+        # One dead worker fails every job on that executor; only the first
+        # of those failures swaps it out, the rest find it already replaced
+        with self._cond:
+            if self._executor is broken and not self._closed:
+                self._executor = self._new_executor()
+                broken.shutdown(wait=False)
+
+    # -------- submission --------
+
+    def submit(self, session_id, fn, *args, **kwargs):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Render pool is shut down")
+            # Jobs that will land on an idle worker don't count as queued
+            free_slots = self.max_workers - len(self._running)
+            waiting = len(self._pending) - max(0, free_slots)
+            if waiting >= self.max_queue:
+                self._counts["rejected"] += 1
+                raise RenderPoolBusy(
+                    f"Render queue is full ({waiting} waiting). Try again shortly."
+                )
+
+            job = RenderJob(session_id, fn, args, kwargs)
+            self._jobs[job.id] = job
+            self._pending.append(job)
+            self._cond.notify_all()
+            return job.id
+
+    def _over_budget(self):
+        if self.cpu_budget is None or not self._running:
+            return False
+        load = cpu_load()
+        return load is not None and load > self.cpu_budget
+
+    def _dispatch_loop(self):
+        with self._cond:
+            while not self._closed:
+                if (not self._pending
+                        or len(self._running) >= self.max_workers
+                        or self._over_budget()):
+                    # Woken on submit/finish; the timeout re-checks the CPU budget
+                    self._cond.wait(timeout=0.5)
+                    continue
+
+                job = self._pending.popleft()
+                job.state = "running"
+                job.started_at = time.time()
+                self._waits.append(job.wait_time())
+                self._running[job.id] = job
+
+                try:
+                    future = self._start(job)
+                except Exception as exc:
+                    self._finish(job, error=exc)
+                    continue
+                future.add_done_callback(lambda f, job=job: self._on_done(job, f))
+
+    def _start(self, job):
+        try:
+            job.executor = self._executor
+            return job.executor.submit(job.fn, *job.args, **job.kwargs)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed); replace the pool and retry once
+            self._replace_executor(job.executor)
+            job.executor = self._executor
+            return job.executor.submit(job.fn, *job.args, **job.kwargs)
+
+    def _on_done(self, job, future):
+        try:
+            result = future.result()
+        except Exception as exc:
+            self._finish(job, error=exc)
+        else:
+            self._finish(job, result=result)
+
+    def _finish(self, job, result=None, error=None):
+        with self._cond:
+            job.finished_at = time.time()
+            job.result = result
+            job.error = error
+            if error is None:
+                job.state = "done"
+                self._counts["completed"] += 1
+            else:
+                job.state = "failed"
+                self._counts["failed"] += 1
+                if isinstance(error, BrokenProcessPool):
+                    self._replace_executor(job.executor)
+            job.executor = None
+
+            self._running.pop(job.id, None)
+            self._finished.append(job)
+            while len(self._finished) > FINISHED_HISTORY:
+                old = self._finished.popleft()
+                self._jobs.pop(old.id, None)
+
+            job.done.set()
+            self._cond.notify_all()
+
+    # -------- queries --------
+
+    def _get(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise KeyError(f"Unknown render job: {job_id}")
+        return job
+
+    def status(self, job_id):
+        with self._cond:
+            job = self._get(job_id)
+            position = self._pending.index(job) + 1 if job.state == "queued" else 0
+            return {
+                "id": job.id,
+                "state": job.state,
+                "position": position,
+                "wait_sec": round(job.wait_time(), 3),
+                "run_sec": round((job.finished_at or time.time()) - job.started_at, 3)
+                if job.started_at else 0.0,
+                "error": str(job.error) if job.error else None
+            }
+
+    def wait(self, job_id, timeout=None):
+        job = self._get(job_id)
+        if not job.done.wait(timeout):
+            raise TimeoutError(f"Render job {job_id} still {job.state}")
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def stats(self):
+        with self._cond:
+            waits = sorted(self._waits)
+            queued_waits = [j.wait_time() for j in self._pending]
+            load = cpu_load()
+            return {
+                "workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "queued": len(self._pending),
+                "running": len(self._running),
+                "completed": self._counts["completed"],
+                "failed": self._counts["failed"],
+                "rejected": self._counts["rejected"],
+                "avg_wait_sec": round(sum(waits) / len(waits), 3) if waits else 0.0,
+                "p95_wait_sec": round(waits[math.ceil(0.95 * len(waits)) - 1], 3) if waits else 0.0,
+                "max_wait_sec": round(waits[-1], 3) if waits else 0.0,
+                "oldest_queued_sec": round(max(queued_waits), 3) if queued_waits else 0.0,
+                "cpu_load": round(load, 2) if load is not None else None
+            }
+
+    def shutdown(self, wait=True):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._executor.shutdown(wait=wait)
+
+
+# -----------------------------
+# Process-wide Singleton
+# -----------------------------
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_render_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = RenderPool()
+        return _pool
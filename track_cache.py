@@ -0,0 +1,51 @@
+import os
+import json
+import hashlib
+import tempfile
+
+
+# -----------------------------
+# Per-track Analysis Cache
+# -----------------------------
+# Small JSON results (tempo, features, ...) keyed by a hash of the file's
+# bytes, so the same song is analysed once no matter what it's called or
+# which render worker picks it up.
+
+CACHE_DIR = os.environ.get(
+    "MOODMIXLY_CACHE_DIR", os.path.join(tempfile.gettempdir(), "moodmixly_cache")
+)
+
+
+def content_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_path(kind, key):
+    return os.path.join(CACHE_DIR, kind, f"{key}.json")
+
+
+def load_cached(kind, key):
+    try:
+        with open(cache_path(kind, key), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_cached(kind, key, data):
+    path = cache_path(kind, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Write then rename so concurrent workers never see a half-written file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+    return data